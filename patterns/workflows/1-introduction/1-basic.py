@@ -1,8 +1,4 @@
-import os
-
-from openai import OpenAI
-
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from shared_client import client
 
 completion = client.chat.completions.create(
   model="gpt-4o",
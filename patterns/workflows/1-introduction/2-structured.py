@@ -1,13 +1,10 @@
-import os
-
 """
 https://platform.openai.com/docs/guides/structured-outputs?api-mode=responses
 """
 
-from openai import OpenAI
 from pydantic import BaseModel
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from shared_client import client
 
 
 class CalendarEvent(BaseModel):
@@ -1,19 +1,21 @@
-import json
-import os
-
+import orjson
 import requests
-from openai import OpenAI
 from pydantic import BaseModel, Field
+from requests.adapters import HTTPAdapter
+
+from shared_client import client
 
 """
 https://platform.openai.com/docs/guides/function-calling?api-mode=responses
 """
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Reuse the open-meteo connection across tool calls
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
 
 
 def get_weather(latitude, longitude):
-  response = requests.get(
+  response = session.get(
     f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m")
   data = response.json()
   print("Current: ", data)
@@ -55,8 +57,6 @@ response = client.chat.completions.create(
 )
 
 # 2 - Model decides to call function(s)
-response.model_dump()
-
 
 # 3 - Execute get_weather function
 def call_function(name, args):
@@ -68,14 +68,14 @@ def call_function(name, args):
 
 for tool_call in response.choices[0].message.tool_calls:
   name = tool_call.function.name
-  args = json.loads(tool_call.function.arguments)
+  args = orjson.loads(tool_call.function.arguments)
   messages.append(response.choices[0].message)  # Update the conversation - keep the memory
 
   result = call_function(name, args)
   messages.append({
       "role": "tool",
       "tool_call_id": tool_call.id,
-      "content": str(result)
+      "content": orjson.dumps(result).decode()
   })
 
 
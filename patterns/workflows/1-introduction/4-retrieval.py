@@ -1,19 +1,41 @@
-import json
-import os
+import re
+from collections import Counter, defaultdict
 
-from openai import OpenAI
+import orjson
 from pydantic import BaseModel, Field
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from shared_client import client
 
 """
 https://platform.openai.com/docs/guides/function-calling
 """
 
 
+STOP_WORDS = {"a", "an", "and", "can", "do", "does", "how", "i", "is", "my", "of", "the", "to", "what", "you"}
+
+
+def tokenize(text: str) -> set[str]:
+  return set(re.findall(r"[a-z0-9]+", text.lower())) - STOP_WORDS
+
+
+# Load the knowledge base once and index the record questions by token
+with open("kb.json", "rb") as f:
+  KB = orjson.loads(f.read())
+
+KB_INDEX: dict[str, list[int]] = defaultdict(list)
+for position, record in enumerate(KB["records"]):
+  for token in tokenize(record["question"]):
+    KB_INDEX[token].append(position)
+
+
 def search_knowledge(question: str):
-  with open("kb.json", "r") as f:
-    return json.load(f)
+  """Return only the records sharing words with the question, or the whole KB if none do"""
+  hits = Counter(position for token in tokenize(question) for position in KB_INDEX.get(token, []))
+  if not hits:
+    return KB
+
+  best = max(hits.values())
+  return {"records": [KB["records"][position] for position, count in sorted(hits.items()) if count == best]}
 
 
 def fallback_answer(question: str):
@@ -72,8 +94,6 @@ response = client.chat.completions.create(
 )
 
 # 2 - Model decides to call function(s)
-response.model_dump()
-
 
 # 3 - Execute get_weather function
 def call_function(name, args):
@@ -87,14 +107,14 @@ def call_function(name, args):
 
 for tool_call in response.choices[0].message.tool_calls:
   name = tool_call.function.name
-  args = json.loads(tool_call.function.arguments)
+  args = orjson.loads(tool_call.function.arguments)
   messages.append(response.choices[0].message)  # Update the conversation - keep the memory
 
   result = call_function(name, args)
   messages.append({
       "role": "tool",
       "tool_call_id": tool_call.id,
-      "content": str(result)
+      "content": orjson.dumps(result).decode()
   })
 
 
@@ -133,11 +153,9 @@ completion_3 = client.beta.chat.completions.parse(
     tools=tools
 )
 
-completion_3.model_dump()
-
 for tool_call in completion_3.choices[0].message.tool_calls:
   name = tool_call.function.name
-  args = json.loads(tool_call.function.arguments)
+  args = orjson.loads(tool_call.function.arguments)
   messages.append(completion_3.choices[0].message)
   # Step 1: Execute the fallback function manually
   result = call_function(name, args)
@@ -146,7 +164,7 @@ for tool_call in completion_3.choices[0].message.tool_calls:
   messages.append({
       "role": "tool",
       "tool_call_id": tool_call.id,
-      "content": str(result)
+      "content": orjson.dumps(result).decode()
   })
 
 # Step 3: Call the model again to generate final assistant message
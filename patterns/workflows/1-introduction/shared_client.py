@@ -0,0 +1,11 @@
+"""
+Single OpenAI client shared by the introduction scripts.
+Each script runs as its own process and sends its calls one after another, so the SDK's default
+keep-alive pool already reuses the connection. The tuned pool and HTTP/2 are set up in
+2-workflow-patterns/shared_client.py, where calls run concurrently.
+"""
+import os
+
+from openai import OpenAI
+
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
@@ -1,12 +1,26 @@
+import asyncio
+import functools
 import logging
 import os
-from datetime import datetime
 from typing import Optional
 
-from openai import OpenAI
+import nest_asyncio
 from pydantic import BaseModel, Field
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from batch_runner import build_request, run_via_batch
+from cache import EMBEDDING_MODEL, SemanticCache, context_key
+from date_context import date_context
+from llm_cache import cached_completion, cached_llm
+from rate_limiter import RateLimiter, async_warm_up, rate_limited
+from schemas import parse_content
+from shared_client import async_client as client
+
+nest_asyncio.apply()
+
+# Throttle before sending rather than retrying on 429, cache hits never reach the limiter
+limiter = RateLimiter(max_requests_per_minute=500, max_tokens_per_minute=30_000)
+cached_create = cached_llm(rate_limited(limiter, client.chat.completions.create))
+create_embedding = rate_limited(limiter, client.embeddings.create)
 
 logging.basicConfig(
   level=logging.INFO,
@@ -17,7 +31,19 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-MODEL = "gpt-4o"
+# Cheap model for the yes/no and categorical gate calls, the larger one for detail extraction
+ROUTER_MODEL = "gpt-4o-mini"
+EXTRACTOR_MODEL = "gpt-4o"
+
+# Static instructions go first and stay byte-identical across calls so OpenAI's prompt caching can
+# reuse them, per-request values such as today's date follow in a separate system message
+EXTRACTION_SYSTEM_PROMPT = "Analyze if the given describes a calendar event"
+DETAILS_SYSTEM_PROMPT = """Extract detailed event information.
+When dates reference 'next Tuesday' or similar relative dates, use the current date given below as reference."""
+FUSED_SYSTEM_PROMPT = """Analyze if the given text describes a calendar event.
+If it is not a calendar event or your confidence is below 0.8, leave details and confirmation null.
+Otherwise extract detailed event information, using the current date given below as reference for relative dates like 'next Tuesday',
+and generate a confirmation message for the event. Sign of with the name, Quang."""
 
 
 # ============================================================
@@ -32,6 +58,9 @@ class EventExtraction(BaseModel):
   confidence_score: float = Field(description="Confidence score between 0 and 1")
 
 
+extraction_cache: SemanticCache[EventExtraction] = SemanticCache(threshold=0.92)
+
+
 class EventDetails(BaseModel):
   """Second LLM call: Parse specific event details"""
   name: str = Field(description="Name of the event")
@@ -42,40 +71,100 @@ class EventDetails(BaseModel):
 
 
 class EventConfirmation(BaseModel):
-  """Third LLM call: Parse specific event details"""
+  """Final response: Confirmation built from the event details"""
   confirmation_message: str = Field(description="Natural language confirmation message to the user")
   calendar_link: Optional[str] = Field(
     description="Generated link to the calendar event if applicable"
   )
 
+
+class FusedEventResult(BaseModel):
+  """Single LLM call: gate, details and confirmation in one response"""
+  is_calendar_event: bool = Field(description="Whether this text describes a calendar event")
+  confidence_score: float = Field(description="Confidence score between 0 and 1")
+  details: Optional[EventDetails] = Field(description="Parsed event details, null if the gate fails")
+  confirmation: Optional[EventConfirmation] = Field(description="Confirmation message, null if the gate fails")
+
 # ============================================================
 # Step 2 - Define the functions
 # ============================================================
 
 
-def extract_event_info(user_input: str) -> Optional[EventExtraction]:
+def extraction_messages(user_input: str) -> list[dict]:
+  """Prompt of the first LLM call"""
+  return [
+      {
+          "role": "system",
+          "content": EXTRACTION_SYSTEM_PROMPT
+      },
+      {
+          "role": "system",
+          "content": date_context()
+      },
+      {
+          "role": "user",
+          "content": user_input
+      }
+  ]
+
+
+def details_messages(description: str) -> list[dict]:
+  """Prompt of the second LLM call"""
+  return [
+      {
+          "role": "system",
+          "content": DETAILS_SYSTEM_PROMPT
+      },
+      {
+          "role": "system",
+          "content": date_context()
+      },
+      {
+          "role": "user",
+          "content": description
+      }
+  ]
+
+
+@functools.cache
+def start_warm_up() -> asyncio.Task:
+  """Open the async client's connection and learn the real rate limits, once, on the first request that misses
+  the exact-match cache. Batch and fully cached runs never get here. The extractor model has the stricter limits,
+  so the shared limiter is seeded from it."""
+  return asyncio.create_task(async_warm_up(client, EXTRACTOR_MODEL, limiter))
+
+
+async def extract_event_info(user_input: str) -> Optional[EventExtraction]:
   """First LLM call to determine if input is a calendar event"""
   logger.info("Start the event extraction analysis")
   logger.debug(f"Input text: {user_input}")
 
-  today = datetime.now()
-  date_context = f"Today is {today.strftime('%A, %B, %d, %Y')}"
-
-  completion = client.beta.chat.completions.parse(
-      model=MODEL,
-      messages=[
-          {
-              "role": "system",
-              "content": f"{date_context} Analyze if the given describes a calendar event"
-          },
-          {
-              "role": "user",
-              "content": user_input
-          }
-      ],
+  messages = extraction_messages(user_input)
+
+  # Exact reruns are answered from disk before paying for the embedding round-trip
+  completion = cached_completion(model=ROUTER_MODEL, messages=messages, response_format=EventExtraction)
+  if completion is not None:
+    logger.info("Exact cache hit for event extraction")
+    return parse_content(completion, EventExtraction)
+
+  start_warm_up()
+
+  # Near-duplicate inputs under the same prompt and date reuse the earlier classification
+  embedding = await create_embedding(input=user_input, model=EMBEDDING_MODEL)
+  vector = embedding.data[0].embedding
+  context = context_key(ROUTER_MODEL, *(message["content"] for message in messages if message["role"] == "system"))
+  cached = extraction_cache.lookup(vector, context)
+  if cached is not None:
+    logger.info("Semantic cache hit for event extraction")
+    # Only the classification is reusable, the description must come from this input
+    return cached.model_copy(update={"description": user_input})
+
+  completion = await cached_create(
+      model=ROUTER_MODEL,
+      messages=messages,
       response_format=EventExtraction
   )
-  result = completion.choices[0].message.parsed
+  result = parse_content(completion, EventExtraction)
 
   if result is None:
     logger.error("Failed to parse event extraction")
@@ -84,58 +173,37 @@ def extract_event_info(user_input: str) -> Optional[EventExtraction]:
   logger.info(
     f"Extraction complete - Is calendar event: {result.is_calendar_event}, Confidence: {result.confidence_score:2f}"
   )
+  extraction_cache.add(vector, context, result)
   return result
 
 
-def parse_event_details(description: str) -> Optional[EventDetails]:
+async def parse_event_details(description: str) -> Optional[EventDetails]:
   """Second LLM call to parse event details"""
   logger.info("Start the event details parsing")
 
-  today = datetime.now()
-  date_context = f"Today is {today.strftime('%A, %B, %d, %Y')}"
-
-  completion = client.beta.chat.completions.parse(
-      model=MODEL,
-      messages=[
-          {
-              "role": "system",
-              "content":
-              f"""{date_context} Extract detailed event information.
-                When dates reference 'next Tuesday' or similar relative dates, use this current date as reference.
-              """
-          },
-          {
-              "role": "user",
-              "content": description
-          }
-      ],
+  completion = await cached_create(
+      model=EXTRACTOR_MODEL,
+      messages=details_messages(description),
       response_format=EventDetails
   )
-  result = completion.choices[0].message.parsed
+  result = parse_content(completion, EventDetails)
 
   logger.info(f"Parsing complete - Event details: {result}")
   return result
 
 
-def generate_confirmation(event_details: EventDetails) -> Optional[EventConfirmation]:
-  """Third LLM call to generate a confirmation message"""
+def generate_confirmation(event_details: EventDetails) -> EventConfirmation:
+  """Format the confirmation message from the parsed details, no LLM call needed"""
   logger.info("Generating the confirmation message")
 
-  completion = client.beta.chat.completions.parse(
-      model=MODEL,
-      messages=[
-          {
-              "role": "system",
-              "content": "Generate a confirmation message for the event. Sign of with the name, Quang."
-          },
-          {
-              "role": "user",
-              "content": str(event_details.model_dump())
-          }
-      ],
-      response_format=EventConfirmation
+  participants = f" with {', '.join(event_details.participants)}" if event_details.participants else ""
+  result = EventConfirmation(
+      confirmation_message=(
+          f"Hi, your event '{event_details.name}' on {event_details.date} "
+          f"for {event_details.duration_minutes} minutes{participants} is booked. — Quang"
+      ),
+      calendar_link=None,
   )
-  result = completion.choices[0].message.parsed
 
   logger.info(f"Confirmation generation complete - Confirmation: {result}")
   return result
@@ -145,13 +213,13 @@ def generate_confirmation(event_details: EventDetails) -> Optional[EventConfirma
 # ============================================================
 
 
-def process_calendar_request(user_input: str) -> Optional[EventConfirmation]:
+async def process_calendar_request(user_input: str) -> Optional[EventConfirmation]:
   """Main function implements the prompt chain with logic gate check"""
   logger.info("Start the calendar request processing")
   logger.debug(f"Raw input text: {user_input}")
 
   # First LLM call
-  info_extraction = extract_event_info(user_input)
+  info_extraction = await extract_event_info(user_input)
 
   if info_extraction is None:
     logger.error("Failed to extract event information")
@@ -168,46 +236,154 @@ def process_calendar_request(user_input: str) -> Optional[EventConfirmation]:
   logger.info("Gate check passed, proceeding with further event processing")
 
   # 2nd LLM call
-  event_details = parse_event_details(info_extraction.description)
+  event_details = await parse_event_details(info_extraction.description)
   if event_details is None:
     logger.error("Failed to parse event details")
     return None
 
-  # 3rd LLM call
+  # Confirmation is plain string formatting over the details
   event_confirmation = generate_confirmation(event_details)
 
   logger.info("Calendar request processing complete")
   return event_confirmation
 
 
+async def process_many(inputs: list[str]) -> list[Optional[EventConfirmation]]:
+  """Run independent chains concurrently so their network I/O overlaps"""
+  logger.info(f"Start processing {len(inputs)} calendar requests concurrently")
+  return await asyncio.gather(*(process_calendar_request(x) for x in inputs))
+
+
+def process_calendar_requests_via_batch(inputs: list[str]) -> list[Optional[EventConfirmation]]:
+  """Offline variant of the chain: each stage runs as one Batch API job over all inputs"""
+  logger.info(f"Start processing {len(inputs)} calendar requests via the Batch API")
+
+  # First stage for every input
+  extractions = run_via_batch(
+      [build_request(str(i), ROUTER_MODEL, extraction_messages(x), EventExtraction) for i, x in enumerate(inputs)],
+      EventExtraction,
+  )
+
+  # Logic gate check
+  passed = {
+      i: extraction for i, extraction in extractions.items()
+      if extraction is not None and extraction.is_calendar_event and extraction.confidence_score >= 0.8
+  }
+  logger.info(f"Gate check passed for {len(passed)} of {len(inputs)} inputs")
+
+  # Second stage for the inputs that passed the gate
+  details = run_via_batch(
+      [build_request(i, EXTRACTOR_MODEL, details_messages(x.description), EventDetails) for i, x in passed.items()],
+      EventDetails,
+  )
+
+  return [
+      generate_confirmation(details[str(i)]) if details.get(str(i)) is not None else None
+      for i in range(len(inputs))
+  ]
+
+
+async def process_calendar_request_fused(user_input: str) -> Optional[EventConfirmation]:
+  """Same task as the chain above, but fused into one LLM call with the gate left to the model"""
+  logger.info("Start the fused calendar request processing")
+  logger.debug(f"Raw input text: {user_input}")
+
+  completion = await cached_create(
+      model=EXTRACTOR_MODEL,
+      messages=[
+          {
+              "role": "system",
+              "content": FUSED_SYSTEM_PROMPT
+          },
+          {
+              "role": "system",
+              "content": date_context()
+          },
+          {
+              "role": "user",
+              "content": user_input
+          }
+      ],
+      response_format=FusedEventResult
+  )
+  result = parse_content(completion, FusedEventResult)
+
+  if result is None or result.details is None or result.confirmation is None:
+    logger.warning("Fused processing returned no event, gate check failed")
+    return None
+
+  logger.info(
+    f"Fused processing complete - Confidence: {result.confidence_score:2f}, Event details: {result.details}"
+  )
+  return result.confirmation
+
+
 # ============================================================
-# Step 4 - Test the chain with a valid input
+# Step 4 - Run the example inputs offline with USE_BATCH=1
 # ============================================================
-prompt_input = """
-Let's schedule a team meeting next Friday, between me in Japan and T from Paris and D from Mumbai to discuss a very important project roadmap.
-Since members will join from different time zone, come up with the most suitable time for everyone.
-Also, explicit tell everyone at which time they will join from their time zone
-"""
+batch_inputs = [
+    "Book a 30 minutes sync with Alice tomorrow at 10am",
+    "Set up a design review with Bob and Carol next Monday afternoon",
+    "What is Python",
+]
 
-final_result = process_calendar_request(prompt_input)
-if final_result:
-  print(f"Confirmation: {final_result.confirmation_message}")
-  if final_result.calendar_link:
-    print(f"Calendar Link: {final_result.calendar_link}")
-else:
-  print("This doesn't appear to be a calendar event request.")
 
+def print_results(inputs: list[str], results: list[Optional[EventConfirmation]]) -> None:
+  for batch_input, batch_result in zip(inputs, results):
+    if batch_result is not None:
+      print(f"{batch_input} -> Confirmation: {batch_result.confirmation_message}")
+    else:
+      print(f"{batch_input} -> This doesn't appear to be a calendar event request.")
 
-# --------------------------------------------------------------
-# Step 5: Test the chain with an invalid input
-# --------------------------------------------------------------
-prompt_input = "What is Python"
-# user_input = "Can you send an email to Alice and Bob to discuss the project roadmap?"
 
-final_result = process_calendar_request(prompt_input)
-if final_result is not None:
-  print(f"Confirmation: {final_result.confirmation_message}")
-  if final_result.calendar_link:
-    print(f"Calendar Link: {final_result.calendar_link}")
+if os.environ.get("USE_BATCH"):
+  print_results(batch_inputs, process_calendar_requests_via_batch(batch_inputs))
 else:
-  print("This doesn't appear to be a calendar event request.")
+  # --------------------------------------------------------------
+  # Step 5: Test the chain with a valid input
+  # --------------------------------------------------------------
+  prompt_input = """
+Let's schedule a team meeting next Friday, between me in Japan and T from Paris and D from Mumbai to discuss a very important project roadmap.
+Since members will join from different time zone, come up with the most suitable time for everyone.
+Also, explicit tell everyone at which time they will join from their time zone
+"""
+
+  final_result = asyncio.run(process_calendar_request(prompt_input))
+  if final_result:
+    print(f"Confirmation: {final_result.confirmation_message}")
+    if final_result.calendar_link:
+      print(f"Calendar Link: {final_result.calendar_link}")
+  else:
+    print("This doesn't appear to be a calendar event request.")
+
+  # --------------------------------------------------------------
+  # Step 6: Test the chain with an invalid input
+  # --------------------------------------------------------------
+  prompt_input = "What is Python"
+  # user_input = "Can you send an email to Alice and Bob to discuss the project roadmap?"
+
+  final_result = asyncio.run(process_calendar_request(prompt_input))
+  if final_result is not None:
+    print(f"Confirmation: {final_result.confirmation_message}")
+    if final_result.calendar_link:
+      print(f"Calendar Link: {final_result.calendar_link}")
+  else:
+    print("This doesn't appear to be a calendar event request.")
+
+  # --------------------------------------------------------------
+  # Step 7: Run several chains concurrently
+  # --------------------------------------------------------------
+  print_results(batch_inputs, asyncio.run(process_many(batch_inputs)))
+
+  # --------------------------------------------------------------
+  # Step 8: Test the fused single-call variant
+  # --------------------------------------------------------------
+  prompt_input = "Let's schedule a team meeting next Tuesday at 2pm with Alice and Bob"
+
+  final_result = asyncio.run(process_calendar_request_fused(prompt_input))
+  if final_result is not None:
+    print(f"Confirmation: {final_result.confirmation_message}")
+    if final_result.calendar_link:
+      print(f"Calendar Link: {final_result.calendar_link}")
+  else:
+    print("This doesn't appear to be a calendar event request.")
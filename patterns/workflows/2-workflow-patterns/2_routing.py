@@ -1,12 +1,24 @@
+import functools
+import json
 import logging
 import os
-from datetime import datetime
+import threading
 from typing import Literal, Optional
 
-from openai import OpenAI
 from pydantic import BaseModel, Field
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from batch_runner import build_request, run_via_batch
+from cache import EMBEDDING_MODEL, SemanticCache, context_key
+from date_context import date_context
+from llm_cache import cached_completion, cached_llm
+from rate_limiter import RateLimiter, rate_limited, warm_up
+from schemas import parse_content
+from shared_client import client
+
+# Throttle before sending rather than retrying on 429, cache hits never reach the limiter
+limiter = RateLimiter(max_requests_per_minute=500, max_tokens_per_minute=30_000)
+cached_create = cached_llm(rate_limited(limiter, client.chat.completions.create))
+create_embedding = rate_limited(limiter, client.embeddings.create)
 
 logging.basicConfig(
   level=logging.INFO,
@@ -16,7 +28,17 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-MODEL = "gpt-4o"
+# Cheap model for the yes/no and categorical gate calls, the larger one for detail extraction
+ROUTER_MODEL = "gpt-4o-mini"
+EXTRACTOR_MODEL = "gpt-4o"
+
+# Static instructions go first and stay byte-identical across calls so OpenAI's prompt caching can
+# reuse them, per-request values such as today's date follow in a separate system message
+ROUTER_SYSTEM_PROMPT = "Determine if this is a request to create a new calendar event or modify an existing one."
+NEW_EVENT_SYSTEM_PROMPT = """Extract detailed event information for creating a new calendar event.
+When dates reference 'next Tuesday' or similar relative dates, use the current date given below as reference."""
+MODIFY_EVENT_SYSTEM_PROMPT = """Extract details for modifying an existing calendar event.
+When dates reference 'next Tuesday' or similar relative dates, use the current date given below as reference."""
 
 # ============================================================
 # Step 1: Define the data models for routing and responses
@@ -32,6 +54,16 @@ class CalendarRequestType(BaseModel):
   description: str = Field(description="Cleaned description of the request")
 
 
+router_cache: SemanticCache[CalendarRequestType] = SemanticCache(threshold=0.92)
+
+
+class RouterBatch(BaseModel):
+  """Router LLM call over several requests at once"""
+  results: list[CalendarRequestType] = Field(
+      description="One routing result per input, in the same order as the inputs"
+  )
+
+
 class NewEventDetails(BaseModel):
   """Details for creating a new event"""
   name: str = Field(description="Name of the event")
@@ -69,22 +101,105 @@ class CalendarResponse(BaseModel):
 # Step 2: Define the routing and processing functions
 # --------------------------------------------------------------
 
+def router_messages(user_input: str) -> list[dict]:
+  """Prompt of the router LLM call"""
+  return [
+      {
+          "role": "system",
+          "content": ROUTER_SYSTEM_PROMPT,
+      },
+      {"role": "user", "content": user_input},
+  ]
+
+
+def new_event_messages(description: str) -> list[dict]:
+  """Prompt of the new event LLM call"""
+  return [
+      {
+          "role": "system",
+          "content": NEW_EVENT_SYSTEM_PROMPT,
+      },
+      {
+          "role": "system",
+          "content": date_context(),
+      },
+      {"role": "user", "content": description},
+  ]
+
+
+def modify_event_messages(description: str) -> list[dict]:
+  """Prompt of the modify event LLM call"""
+  return [
+      {
+          "role": "system",
+          "content": MODIFY_EVENT_SYSTEM_PROMPT,
+      },
+      {
+          "role": "system",
+          "content": date_context(),
+      },
+      {"role": "user", "content": description},
+  ]
+
+
+def new_event_response(details: NewEventDetails) -> CalendarResponse:
+  """Final response for a created event"""
+  return CalendarResponse(
+      success=True,
+      message=f"Created new event '{details.name}' for {details.date} with {', '.join(details.participants)}",
+      calendar_link=f"calendar://new?event={details.name}",
+  )
+
+
+def modify_event_response(details: ModifyEventDetails) -> CalendarResponse:
+  """Final response for a modified event"""
+  return CalendarResponse(
+      success=True,
+      message=f"Modified event '{details.event_identifier}' with the requested changes",
+      calendar_link=f"calendar://modify?event={details.event_identifier}",
+  )
+
+
+@functools.cache
+def start_warm_up() -> threading.Thread:
+  """Learn the real rate limits in the background, once, on the first request that misses the exact-match cache.
+  Batch and fully cached runs never get here. The extractor model has the stricter limits, so the shared limiter
+  is seeded from it."""
+  thread = threading.Thread(target=warm_up, args=(client, EXTRACTOR_MODEL, limiter), daemon=True)
+  thread.start()
+  return thread
+
+
 def route_calendar_request(user_input: str) -> Optional[CalendarRequestType]:
   """Router LLM call to determine the type of calendar request"""
   logger.info("Routing calendar request")
 
-  completion = client.beta.chat.completions.parse(
-      model=MODEL,
-      messages=[
-          {
-              "role": "system",
-              "content": "Determine if this is a request to create a new calendar event or modify an existing one.",
-          },
-          {"role": "user", "content": user_input},
-      ],
+  messages = router_messages(user_input)
+
+  # Exact reruns are answered from disk before paying for the embedding round-trip
+  completion = cached_completion(model=ROUTER_MODEL, messages=messages, response_format=CalendarRequestType)
+  if completion is not None:
+    logger.info("Exact cache hit for request routing")
+    return parse_content(completion, CalendarRequestType)
+
+  start_warm_up()
+
+  # Near-duplicate inputs reuse the earlier routing decision
+  embedding = create_embedding(input=user_input, model=EMBEDDING_MODEL)
+  vector = embedding.data[0].embedding
+  context = context_key(ROUTER_MODEL, ROUTER_SYSTEM_PROMPT)
+  cached = router_cache.lookup(vector, context)
+  if cached is not None:
+    logger.info(f"Semantic cache hit, request routed as: {cached.request_type}")
+    # Only the routing decision is reusable, the description must come from this input
+    return cached.model_copy(update={"description": user_input})
+
+  completion = cached_create(
+      model=ROUTER_MODEL,
+      messages=messages,
       response_format=CalendarRequestType,
   )
-  result = completion.choices[0].message.parsed
+  result = parse_content(completion, CalendarRequestType)
   if result is None:
     logger.error("Failed to parse event extraction")
     return None
@@ -92,32 +207,56 @@ def route_calendar_request(user_input: str) -> Optional[CalendarRequestType]:
   logger.info(
       f"Request routed as: {result.request_type} with confidence: {result.confidence_score}"
   )
+  router_cache.add(vector, context, result)
   return result
 
 
-def handle_new_event(description: str) -> Optional[CalendarResponse]:
-  """Process a new event request"""
-  logger.info("Processing new event request")
-
-  today = datetime.now()
-  date_context = f"Today is {today.strftime('%A, %B, %d, %Y')}"
+def route_calendar_requests(user_inputs: list[str]) -> Optional[list[CalendarRequestType]]:
+  """Single router LLM call classifying several requests, so the system prompt is sent once"""
+  logger.info(f"Routing {len(user_inputs)} calendar requests in one call")
 
-  # Get event details
-  completion = client.beta.chat.completions.parse(
-      model=MODEL,
+  completion = cached_create(
+      model=ROUTER_MODEL,
       messages=[
           {
               "role": "system",
               "content":
-              f"""{date_context} Extract detailed event information for creating a new calendar event.
-                When dates reference 'next Tuesday' or similar relative dates, use this current date as reference.
-              """
+              f"""{ROUTER_SYSTEM_PROMPT}
+                The user message is a JSON object whose "inputs" array holds independent requests.
+                Classify each request on its own and return exactly one result per input, in the same order.
+              """,
           },
-          {"role": "user", "content": description},
+          {"role": "user", "content": json.dumps({"inputs": user_inputs})},
       ],
+      response_format=RouterBatch,
+  )
+  result = parse_content(completion, RouterBatch)
+  if result is None:
+    logger.error("Failed to parse batched routing")
+    return None
+
+  if len(result.results) != len(user_inputs):
+    logger.error(f"Expected {len(user_inputs)} routing results, got {len(result.results)}")
+    return None
+
+  for route in result.results:
+    logger.info(
+        f"Request routed as: {route.request_type} with confidence: {route.confidence_score}"
+    )
+  return result.results
+
+
+def handle_new_event(description: str) -> Optional[CalendarResponse]:
+  """Process a new event request"""
+  logger.info("Processing new event request")
+
+  # Get event details
+  completion = cached_create(
+      model=EXTRACTOR_MODEL,
+      messages=new_event_messages(description),
       response_format=NewEventDetails,
   )
-  details = completion.choices[0].message.parsed
+  details = parse_content(completion, NewEventDetails)
 
   if details is None:
     logger.error("Failed to parse event extraction")
@@ -126,37 +265,20 @@ def handle_new_event(description: str) -> Optional[CalendarResponse]:
   logger.info(f"New event: {details.model_dump_json(indent=2)}")
 
   # Generate response
-  return CalendarResponse(
-      success=True,
-      message=f"Created new event '{details.name}' for {details.date} with {', '.join(details.participants)}",
-      calendar_link=f"calendar://new?event={details.name}",
-  )
+  return new_event_response(details)
 
 
 def handle_modify_event(description: str) -> Optional[CalendarResponse]:
   """Process an event modification request"""
   logger.info("Processing event modification request")
 
-  today = datetime.now()
-  date_context = f"Today is {today.strftime('%A, %B, %d, %Y')}"
-
   # Get modification details
-  completion = client.beta.chat.completions.parse(
-      model=MODEL,
-      messages=[
-          {
-              "role": "system",
-              "content":
-              f""" {date_context}
-								Extract details for modifying an existing calendar event.
-								When dates reference 'next Tuesday' or similar relative dates, use this current date as reference.
-              """,
-          },
-          {"role": "user", "content": description},
-      ],
+  completion = cached_create(
+      model=EXTRACTOR_MODEL,
+      messages=modify_event_messages(description),
       response_format=ModifyEventDetails,
   )
-  details = completion.choices[0].message.parsed
+  details = parse_content(completion, ModifyEventDetails)
 
   if details is None:
     logger.error("Failed to parse event extraction")
@@ -165,11 +287,7 @@ def handle_modify_event(description: str) -> Optional[CalendarResponse]:
   logger.info(f"Modified event: {details.model_dump_json(indent=2)}")
 
   # Generate response
-  return CalendarResponse(
-      success=True,
-      message=f"Modified event '{details.event_identifier}' with the requested changes",
-      calendar_link=f"calendar://modify?event={details.event_identifier}",
-  )
+  return modify_event_response(details)
 
 
 def process_calendar_request(user_input: str) -> Optional[CalendarResponse]:
@@ -198,31 +316,90 @@ def process_calendar_request(user_input: str) -> Optional[CalendarResponse]:
     return None
 
 
-# --------------------------------------------------------------
-# Step 3: Test with new event
-# --------------------------------------------------------------
+def process_calendar_requests_via_batch(inputs: list[str]) -> list[Optional[CalendarResponse]]:
+  """Offline variant of the routing workflow: each stage runs as one Batch API job over all inputs"""
+  logger.info(f"Processing {len(inputs)} calendar requests via the Batch API")
+
+  # Route every request
+  routes = run_via_batch(
+      [build_request(str(i), ROUTER_MODEL, router_messages(x), CalendarRequestType) for i, x in enumerate(inputs)],
+      CalendarRequestType,
+  )
+  confident = {
+      i: route for i, route in routes.items()
+      if route is not None and route.confidence_score >= 0.7
+  }
+
+  # Run each handler stage once for all requests routed to it
+  new_details = run_via_batch(
+      [build_request(i, EXTRACTOR_MODEL, new_event_messages(r.description), NewEventDetails)
+       for i, r in confident.items() if r.request_type == "NEW"],
+      NewEventDetails,
+  )
+  modify_details = run_via_batch(
+      [build_request(i, EXTRACTOR_MODEL, modify_event_messages(r.description), ModifyEventDetails)
+       for i, r in confident.items() if r.request_type == "MODIFY"],
+      ModifyEventDetails,
+  )
+
+  responses: list[Optional[CalendarResponse]] = []
+  for i in range(len(inputs)):
+    if new_details.get(str(i)) is not None:
+      responses.append(new_event_response(new_details[str(i)]))
+    elif modify_details.get(str(i)) is not None:
+      responses.append(modify_event_response(modify_details[str(i)]))
+    else:
+      responses.append(None)
+  return responses
 
-new_event_input = "Let's schedule a team meeting next Tuesday at 2pm with Alice and Bob"
-result = process_calendar_request(new_event_input)
-if result:
-  print(f"Response: {result.message}")
 
 # --------------------------------------------------------------
-# Step 4: Test with modify event
+# Step 3: Run all test inputs offline with USE_BATCH=1
 # --------------------------------------------------------------
 
+new_event_input = "Let's schedule a team meeting next Tuesday at 2pm with Alice and Bob"
 modify_event_input = (
     "Can you move the team meeting with Alice and Bob to Wednesday at 3pm instead? I think Quang also wants to join as well."
 )
-result = process_calendar_request(modify_event_input)
-if result:
-  print(f"Response: {result.message}")
-
-# --------------------------------------------------------------
-# Step 5: Test with invalid request
-# --------------------------------------------------------------
-
 invalid_input = "A"
-result = process_calendar_request(invalid_input)
-if not result:
-  print("Request not recognized as a calendar operation")
+
+if os.environ.get("USE_BATCH"):
+  batch_inputs = [new_event_input, modify_event_input, invalid_input]
+  for batch_input, result in zip(batch_inputs, process_calendar_requests_via_batch(batch_inputs)):
+    if result:
+      print(f"{batch_input} -> Response: {result.message}")
+    else:
+      print(f"{batch_input} -> Request not recognized as a calendar operation")
+else:
+  # --------------------------------------------------------------
+  # Step 4: Test with new event
+  # --------------------------------------------------------------
+
+  result = process_calendar_request(new_event_input)
+  if result:
+    print(f"Response: {result.message}")
+
+  # --------------------------------------------------------------
+  # Step 5: Test with modify event
+  # --------------------------------------------------------------
+
+  result = process_calendar_request(modify_event_input)
+  if result:
+    print(f"Response: {result.message}")
+
+  # --------------------------------------------------------------
+  # Step 6: Test with invalid request
+  # --------------------------------------------------------------
+
+  result = process_calendar_request(invalid_input)
+  if not result:
+    print("Request not recognized as a calendar operation")
+
+  # --------------------------------------------------------------
+  # Step 7: Route all test inputs with a single call
+  # --------------------------------------------------------------
+
+  routes = route_calendar_requests([new_event_input, modify_event_input, invalid_input])
+  if routes:
+    for route in routes:
+      print(f"Routed as: {route.request_type} ({route.confidence_score}) - {route.description}")
@@ -0,0 +1,79 @@
+"""
+https://platform.openai.com/docs/guides/batch
+Offline runner for the example inputs: half the token price and a separate rate-limit pool,
+in exchange for results that arrive within the completion window instead of interactively.
+"""
+import io
+import json
+import logging
+import time
+from typing import Optional, TypeVar
+
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel, ValidationError
+
+from schemas import parse_content, response_format_param
+from shared_client import client
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+
+ENDPOINT = "/v1/chat/completions"
+
+
+def build_request(custom_id: str, model: str, messages: list[dict], response_format: type[BaseModel]) -> dict:
+  """One JSONL line of the batch input file"""
+  return {
+      "custom_id": custom_id,
+      "method": "POST",
+      "url": ENDPOINT,
+      "body": {
+          "model": model,
+          "messages": messages,
+          "response_format": response_format_param(response_format),
+      },
+  }
+
+
+def run_via_batch(
+    requests: list[dict],
+    response_format: type[T],
+    poll_interval: float = 30,
+) -> dict[str, Optional[T]]:
+  """Submit the requests as one batch, wait for it and return the parsed results by custom_id"""
+  if not requests:
+    return {}
+
+  payload = "\n".join(json.dumps(request) for request in requests).encode("utf-8")
+  input_file = client.files.create(file=("batch_input.jsonl", io.BytesIO(payload)), purpose="batch")
+  batch = client.batches.create(
+      input_file_id=input_file.id,
+      endpoint=ENDPOINT,
+      completion_window="24h",
+  )
+  logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+  while batch.status not in ("completed", "failed", "expired", "cancelled"):
+    time.sleep(poll_interval)
+    batch = client.batches.retrieve(batch.id)
+    logger.info(f"Batch {batch.id} status: {batch.status}")
+
+  results: dict[str, Optional[T]] = {request["custom_id"]: None for request in requests}
+  if batch.output_file_id is None:
+    logger.error(f"Batch {batch.id} finished without output, status: {batch.status}")
+    return results
+
+  for line in client.files.content(batch.output_file_id).text.splitlines():
+    record = json.loads(line)
+    response = record.get("response")
+    if response is None or response["status_code"] != 200:
+      logger.error(f"Batch request {record['custom_id']} failed: {record.get('error')}")
+      continue
+
+    try:
+      results[record["custom_id"]] = parse_content(ChatCompletion.model_validate(response["body"]), response_format)
+    except ValidationError as e:
+      logger.error(f"Batch request {record['custom_id']} returned invalid output: {e}")
+
+  return results
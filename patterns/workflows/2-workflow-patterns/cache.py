@@ -0,0 +1,55 @@
+"""
+Semantic response cache for classification-like LLM calls.
+Inputs are embedded and compared with cosine similarity against previous inputs,
+so near-duplicate requests can reuse an earlier structured result.
+"""
+import hashlib
+from typing import Generic, Optional, TypeVar
+
+import numpy as np
+from pydantic import BaseModel
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def context_key(*parts: str) -> str:
+  """Hash the prompt context (model, system prompt, date...) a cached result depends on"""
+  return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class SemanticCache(Generic[T]):
+  """Exact inner-product search over L2-normalized embeddings, bucketed by prompt context"""
+
+  def __init__(self, threshold: float = 0.92):
+    self.threshold = threshold
+    self._vectors: dict[str, np.ndarray] = {}
+    self._results: dict[str, list[T]] = {}
+
+  @staticmethod
+  def _normalize(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+  def lookup(self, embedding: list[float], context: str) -> Optional[T]:
+    """Return a copy of the closest cached result if it is similar enough, else None"""
+    vectors = self._vectors.get(context)
+    if vectors is None:
+      return None
+
+    scores = vectors @ self._normalize(embedding)
+    best = int(np.argmax(scores))
+    if scores[best] <= self.threshold:
+      return None
+
+    return self._results[context][best].model_copy(deep=True)
+
+  def add(self, embedding: list[float], context: str, result: T) -> None:
+    """Store the result of a fresh LLM call"""
+    vector = self._normalize(embedding)[np.newaxis, :]
+    if context in self._vectors:
+      self._vectors[context] = np.vstack([self._vectors[context], vector])
+    else:
+      self._vectors[context] = vector
+    self._results.setdefault(context, []).append(result)
@@ -0,0 +1,16 @@
+"""
+Date context injected into prompts that resolve relative dates like 'next Tuesday'.
+Formatted once per day instead of once per LLM call.
+"""
+import functools
+from datetime import date
+
+
+@functools.lru_cache(maxsize=1)
+def _date_context_for(day: date) -> str:
+  return f"Today is {day.strftime('%A, %B, %d, %Y')}"
+
+
+def date_context() -> str:
+  """Today's date context, recomputed only when the day changes"""
+  return _date_context_for(date.today())
@@ -0,0 +1,92 @@
+"""
+Exact-match cache for structured LLM calls.
+Identical (model, messages, response schema) payloads are answered from disk, so reruns of the
+same examples cost no tokens and no network round-trip.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shelve
+import time
+from typing import Any, Optional
+
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+from schemas import response_format_param
+
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".llm_cache")
+CACHE_TTL_SECONDS = 86400
+
+
+def cache_key(model: str, messages: list[dict], response_format: type[BaseModel], **kwargs: Any) -> str:
+  """SHA256 of the full request payload"""
+  payload = json.dumps(
+      {
+          "model": model,
+          "messages": messages,
+          "response_format": response_format_param(response_format),
+          **kwargs,
+      },
+      sort_keys=True,
+      default=str,
+  )
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _get(key: str) -> Optional[ChatCompletion]:
+  with shelve.open(CACHE_PATH) as db:
+    entry = db.get(key)
+  if entry is None:
+    return None
+
+  expires_at, raw = entry
+  if expires_at < time.time():
+    return None
+  return ChatCompletion.model_validate_json(raw)
+
+
+def _set(key: str, completion: ChatCompletion) -> None:
+  with shelve.open(CACHE_PATH) as db:
+    db[key] = (time.time() + CACHE_TTL_SECONDS, completion.model_dump_json())
+
+
+def cached_completion(
+    *, model: str, messages: list[dict], response_format: type[BaseModel], **kwargs: Any
+) -> Optional[ChatCompletion]:
+  """Cached completion for this exact payload, without calling the API on a miss"""
+  return _get(cache_key(model, messages, response_format, **kwargs))
+
+
+def cached_llm(create):
+  """Wrap a sync or async `client.chat.completions.create` with the exact-match cache.
+  The wrapper takes the pydantic model as `response_format` and sends its precomputed strict schema."""
+  # The SDK wraps `create` in a plain function that returns the coroutine, so look through the wrappers
+  if inspect.iscoroutinefunction(inspect.unwrap(create)):
+    @functools.wraps(create)
+    async def async_wrapper(*, model: str, messages: list[dict], response_format: type[BaseModel], **kwargs):
+      key = cache_key(model, messages, response_format, **kwargs)
+      completion = _get(key)
+      if completion is None:
+        completion = await create(
+            model=model, messages=messages, response_format=response_format_param(response_format), **kwargs
+        )
+        _set(key, completion)
+      return completion
+
+    return async_wrapper
+
+  @functools.wraps(create)
+  def wrapper(*, model: str, messages: list[dict], response_format: type[BaseModel], **kwargs):
+    key = cache_key(model, messages, response_format, **kwargs)
+    completion = _get(key)
+    if completion is None:
+      completion = create(
+          model=model, messages=messages, response_format=response_format_param(response_format), **kwargs
+      )
+      _set(key, completion)
+    return completion
+
+  return wrapper
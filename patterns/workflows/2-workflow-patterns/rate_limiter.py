@@ -0,0 +1,167 @@
+"""
+Proactive client-side throttling, modeled on the OpenAI cookbook's api_request_parallel_processor.py.
+Requests wait for request and token capacity before they are sent, instead of being rejected
+with a 429 and retried with backoff.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from typing import Mapping, Optional, Union
+
+import tiktoken
+from openai import AsyncOpenAI, OpenAI, OpenAIError
+
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_MESSAGES = [{"role": "user", "content": "."}]
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding_for(model: str) -> Optional[tiktoken.Encoding]:
+  """tiktoken encoding of the model, or None when its BPE file cannot be loaded"""
+  try:
+    try:
+      return tiktoken.encoding_for_model(model)
+    except KeyError:
+      return tiktoken.get_encoding("o200k_base")
+  except Exception as e:  # pylint: disable=broad-exception-caught
+    # The BPE file is downloaded on first use, an estimate must never break the actual call
+    logger.warning(f"Falling back to a character based token estimate: {e}")
+    return None
+
+
+def _count_tokens(encoding: Optional[tiktoken.Encoding], text: str) -> int:
+  if encoding is None:
+    return len(text) // 4
+  return len(encoding.encode(text))
+
+
+def estimate_tokens(
+    model: str,
+    messages: Optional[list[dict]] = None,
+    inputs: Union[str, list[str], None] = None,
+) -> int:
+  """Rough prompt token count of a chat or embeddings request"""
+  encoding = _encoding_for(model)
+
+  if messages is not None:
+    # Every message is wrapped in a few formatting tokens, and the reply is primed with a few more
+    return sum(4 + _count_tokens(encoding, str(message.get("content") or "")) for message in messages) + 2
+
+  texts = [inputs] if isinstance(inputs, str) else inputs or []
+  return sum(_count_tokens(encoding, text) for text in texts)
+
+
+class RateLimiter:
+  """Token bucket over both requests and tokens per minute, refilled continuously"""
+
+  def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+    self.max_requests_per_minute = max_requests_per_minute
+    self.max_tokens_per_minute = max_tokens_per_minute
+    self.available_request_capacity = max_requests_per_minute
+    self.available_token_capacity = max_tokens_per_minute
+    self._last_update = time.monotonic()
+    # The warm-up updates the limits from another thread, guard every read-modify-write
+    self._lock = threading.Lock()
+
+  def update_from_headers(self, headers: Mapping[str, str]) -> None:
+    """Adopt the account's real limits from the x-ratelimit-* headers of a response"""
+    with self._lock:
+      self._refill()
+      if "x-ratelimit-limit-requests" in headers:
+        self.max_requests_per_minute = float(headers["x-ratelimit-limit-requests"])
+      if "x-ratelimit-limit-tokens" in headers:
+        self.max_tokens_per_minute = float(headers["x-ratelimit-limit-tokens"])
+      if "x-ratelimit-remaining-requests" in headers:
+        self.available_request_capacity = float(headers["x-ratelimit-remaining-requests"])
+      if "x-ratelimit-remaining-tokens" in headers:
+        self.available_token_capacity = float(headers["x-ratelimit-remaining-tokens"])
+
+  def _refill(self) -> None:
+    now = time.monotonic()
+    elapsed = now - self._last_update
+    self._last_update = now
+    self.available_request_capacity = min(
+        self.max_requests_per_minute,
+        self.available_request_capacity + self.max_requests_per_minute * elapsed / 60,
+    )
+    self.available_token_capacity = min(
+        self.max_tokens_per_minute,
+        self.available_token_capacity + self.max_tokens_per_minute * elapsed / 60,
+    )
+
+  def _try_acquire(self, tokens: int, requests: int) -> float:
+    """Take the capacity if available and return 0, else return how long to wait"""
+    with self._lock:
+      self._refill()
+      # A single request larger than the whole bucket would never fit, so cap it at the bucket size
+      tokens = min(tokens, self.max_tokens_per_minute)
+      missing_requests = requests - self.available_request_capacity
+      missing_tokens = tokens - self.available_token_capacity
+      if missing_requests <= 0 and missing_tokens <= 0:
+        self.available_request_capacity -= requests
+        self.available_token_capacity -= tokens
+        return 0
+
+      return max(
+          missing_requests * 60 / self.max_requests_per_minute,
+          missing_tokens * 60 / self.max_tokens_per_minute,
+      )
+
+  async def acquire(self, tokens: int, requests: int = 1) -> None:
+    while (wait := self._try_acquire(tokens, requests)) > 0:
+      await asyncio.sleep(wait)
+
+  def acquire_blocking(self, tokens: int, requests: int = 1) -> None:
+    while (wait := self._try_acquire(tokens, requests)) > 0:
+      time.sleep(wait)
+
+
+def rate_limited(limiter: RateLimiter, call):
+  """Wrap a sync or async OpenAI call so it first waits for capacity in the limiter"""
+  # The SDK wraps `create` in a plain function that returns the coroutine, so look through the wrappers
+  if inspect.iscoroutinefunction(inspect.unwrap(call)):
+    @functools.wraps(call)
+    async def async_wrapper(*, model: str, **kwargs):
+      await limiter.acquire(estimate_tokens(model, kwargs.get("messages"), kwargs.get("input")))
+      return await call(model=model, **kwargs)
+
+    return async_wrapper
+
+  @functools.wraps(call)
+  def wrapper(*, model: str, **kwargs):
+    limiter.acquire_blocking(estimate_tokens(model, kwargs.get("messages"), kwargs.get("input")))
+    return call(model=model, **kwargs)
+
+  return wrapper
+
+
+def _seed_from_warm_up(limiter: RateLimiter, headers: Mapping[str, str]) -> None:
+  logger.info(
+      f"Connection warmed up - Requests limit: {headers.get('x-ratelimit-limit-requests')}, Tokens limit: {headers.get('x-ratelimit-limit-tokens')}"
+  )
+  limiter.update_from_headers(headers)
+
+
+def warm_up(client: OpenAI, model: str, limiter: RateLimiter) -> None:
+  """1-token request that opens the client's pooled connection and seeds the limiter with the real rate limits"""
+  try:
+    raw = client.chat.completions.with_raw_response.create(model=model, messages=WARM_UP_MESSAGES, max_tokens=1)
+  except OpenAIError as e:
+    logger.warning(f"Connection warm-up failed: {e}")
+    return
+  _seed_from_warm_up(limiter, raw.headers)
+
+
+async def async_warm_up(client: AsyncOpenAI, model: str, limiter: RateLimiter) -> None:
+  """Same as `warm_up`, on an async client"""
+  try:
+    raw = await client.chat.completions.with_raw_response.create(model=model, messages=WARM_UP_MESSAGES, max_tokens=1)
+  except OpenAIError as e:
+    logger.warning(f"Connection warm-up failed: {e}")
+    return
+  _seed_from_warm_up(limiter, raw.headers)
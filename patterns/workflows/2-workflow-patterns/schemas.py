@@ -0,0 +1,62 @@
+"""
+https://platform.openai.com/docs/guides/structured-outputs#supported-schemas
+Strict JSON schema response formats, derived once per pydantic model and sent as-is with
+`client.chat.completions.create`, so no request regenerates the schema.
+Built here from `model_json_schema()` rather than with the SDK's private helpers, so an SDK upgrade
+cannot break the import.
+"""
+import functools
+from typing import Any, Optional, TypeVar
+
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def _resolve(root: dict, ref: str) -> dict:
+  node: Any = root
+  for part in ref.removeprefix("#/").split("/"):
+    node = node[part]
+  return node
+
+
+def _make_strict(node: Any, root: dict) -> Any:
+  """Apply the strict mode rules: closed objects, every property required, no `$ref` siblings"""
+  if isinstance(node, list):
+    return [_make_strict(item, root) for item in node]
+  if not isinstance(node, dict):
+    return node
+
+  if "$ref" in node and len(node) > 1:
+    # Strict mode rejects keywords next to `$ref`, so inline the definition instead
+    resolved = {**_resolve(root, node["$ref"]), **{k: v for k, v in node.items() if k != "$ref"}}
+    return _make_strict(resolved, root)
+
+  strict = {key: _make_strict(value, root) for key, value in node.items()}
+  if strict.get("type") == "object" and "properties" in strict:
+    strict["additionalProperties"] = False
+    strict["required"] = list(strict["properties"])
+  if strict.get("default", ...) is None:
+    strict.pop("default")
+  return strict
+
+
+@functools.cache
+def response_format_param(response_format: type[BaseModel]) -> dict:
+  """`{"type": "json_schema", ...}` form of a structured output model"""
+  schema = response_format.model_json_schema()
+  return {
+      "type": "json_schema",
+      "json_schema": {
+          "name": response_format.__name__,
+          "schema": _make_strict(schema, schema),
+          "strict": True,
+      },
+  }
+
+
+def parse_content(completion: ChatCompletion, response_format: type[T]) -> Optional[T]:
+  """Structured output of a completion, None when the model refused or returned nothing"""
+  content = completion.choices[0].message.content
+  return response_format.model_validate_json(content) if content else None
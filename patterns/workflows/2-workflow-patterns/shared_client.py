@@ -0,0 +1,25 @@
+"""
+Single OpenAI client per process, backed by a pooled keep-alive HTTP/2 connection,
+so every call after the first skips the TCP + TLS handshake and concurrent calls
+are multiplexed over the same connection.
+"""
+import os
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=50,
+    max_connections=100,
+    keepalive_expiry=85,
+)
+
+client = OpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    http_client=DefaultHttpxClient(http2=True, limits=HTTP_LIMITS),
+)
+
+async_client = AsyncOpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(http2=True, limits=HTTP_LIMITS),
+)